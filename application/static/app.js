@@ -1,10 +1,14 @@
 // WhatsApp Web - Essencial
-const API = 'http://localhost:8001/api';
+const BACKEND = 'http://localhost:8001';
+const API = `${BACKEND}/api`;
 const WS = 'ws://localhost:8001/ws';
 
 let phone = localStorage.getItem('phone') || '';
 let currentChat = null;
 let ws = null;
+let lastOffset = null; // Último evento do journal recebido (replay na reconexão)
+let replaying = false; // Replay do journal em andamento: lista de chats só recarrega no fim
+let chatsStale = false;
 let session = 'default';
 
 // Elements
@@ -471,6 +475,17 @@ function renderMediaHtml(media) {
     // Corrigir a URL para passar pelo backend
     const mediaUrl = media.url.replace('http://localhost:3000', 'http://localhost:8001');
     
+    // Thumbnail gerado pelo backend: o arquivo completo só é baixado no clique
+    if (media.thumbnailUrl) {
+        const placeholder = media.placeholder ? `style="background-image: url('${media.placeholder}')"` : '';
+        const isVideo = media.mimetype.startsWith('video/');
+        return `
+            <div class="message-media media-thumb ${isVideo ? 'media-video' : ''}" onclick="openMediaModal('${mediaUrl}', '${media.mimetype}')">
+                <img src="${BACKEND}${media.thumbnailUrl}" alt="${isVideo ? 'Video' : 'Image'}" loading="lazy" ${placeholder} data-label="${media.filename || (isVideo ? 'Vídeo' : 'Imagem')}" onerror="mediaThumbFallback(this)">
+            </div>
+        `;
+    }
+    
     if (media.mimetype && media.mimetype.startsWith('image/')) {
         return `<div class="message-media"><img src="${mediaUrl}" alt="Image" onerror="this.style.display='none'"></div>`;
     } else {
@@ -478,6 +493,35 @@ function renderMediaHtml(media) {
     }
 }
 
+// Thumbnail indisponível: troca por um link que ainda abre a mídia completa
+function mediaThumbFallback(img) {
+    const link = document.createElement('div');
+    link.className = 'media-placeholder';
+    link.textContent = `📎 ${img.dataset.label}`;
+    img.parentElement.classList.remove('media-video');
+    img.replaceWith(link);
+}
+
+function openMediaModal(url, mimetype) {
+    const content = mimetype.startsWith('video/')
+        ? `<video class="modal-image" src="${url}" controls autoplay></video>`
+        : `<img class="modal-image" src="${url}" alt="Image">`;
+    
+    const modal = document.createElement('div');
+    modal.className = 'image-modal';
+    modal.style.display = 'flex';
+    modal.innerHTML = `
+        <div class="modal-overlay"></div>
+        <div class="modal-content">
+            ${content}
+            <button class="modal-close">&times;</button>
+        </div>
+    `;
+    modal.querySelector('.modal-overlay').onclick = () => modal.remove();
+    modal.querySelector('.modal-close').onclick = () => modal.remove();
+    document.body.appendChild(modal);
+}
+
 function createMessageHtml(message) {
     const messageText = message.body || message.text || '';
     const time = message.timestamp ? formatMessageTime(message.timestamp) : '';
@@ -555,7 +599,9 @@ async function sendMessage() {
 function connectWS() {
     if (ws) return;
     
-    ws = new WebSocket(`${WS}/${phone}`);
+    const query = lastOffset !== null ? `?offset=${lastOffset}` : '';
+    ws = new WebSocket(`${WS}/${phone}${query}`);
+    replaying = lastOffset !== null;
     
     ws.onopen = () => {
         console.log('✅ WebSocket conectado!');
@@ -569,7 +615,31 @@ function connectWS() {
             console.log('📡 Event:', data.event);
             console.log('📡 Data field:', data.data);
             
-            if (data.event === 'auth_failure') {
+            if (typeof data.offset === 'number') {
+                // Evento já recebido (replay e broadcast ao vivo podem se sobrepor)
+                if (lastOffset !== null && data.offset <= lastOffset) return;
+                lastOffset = data.offset;
+            }
+            
+            if (data.event === 'journal.sync') {
+                // Offset inicial; nada a reprocessar
+                if (lastOffset === null || data.head > lastOffset) lastOffset = data.head;
+            } else if (data.event === 'journal.replay_end') {
+                console.log(`🔁 Replay concluído: ${data.replayed} evento(s)`);
+                replaying = false;
+                if (chatsStale) refreshChats();
+            } else if (data.event === 'journal.reset') {
+                // Eventos perdidos já saíram da retenção do backend: resync completo
+                console.log('🔁 Journal reiniciado, recarregando chats');
+                lastOffset = data.head;
+                replaying = false;
+                refreshChats();
+                if (currentChat) {
+                    api(`/default/chats/${encodeURIComponent(currentChat)}/messages?limit=40`)
+                        .then(renderMessages)
+                        .catch(() => notify('Erro ao carregar mensagens', 'error'));
+                }
+            } else if (data.event === 'auth_failure') {
                 showLogin();
                 notify('Falha na autenticação', 'error');
             } else if (data.event === 'qr') {
@@ -595,6 +665,7 @@ function connectWS() {
     
     ws.onclose = () => {
         ws = null;
+        replaying = false;
         setTimeout(connectWS, 5000);
     };
     
@@ -640,7 +711,7 @@ function handleNewMessage(messageData) {
         console.log('📨 Mensagem não é para o chat atual');
     }
     
-    loadChats();
+    refreshChats();
 }
 
 function handleMessageAck(ackData) {
@@ -649,6 +720,16 @@ function handleMessageAck(ackData) {
 
 function handleChatUpdate(chatData) {
     console.log('Chat atualizado:', chatData);
+    refreshChats();
+}
+
+// Durante o replay só o chat aberto é atualizado; a lista recarrega uma vez no fim
+function refreshChats() {
+    if (replaying) {
+        chatsStale = true;
+        return;
+    }
+    chatsStale = false;
     loadChats();
 }
 
@@ -0,0 +1,408 @@
+"""
+Analytics de conversas de venda - agregação incremental a partir dos webhooks
+Tempo de primeira resposta, latência de resposta, chats sem resposta e mensagens/hora
+"""
+
+import logging
+import math
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    # numpy não instalado, backfill usa o caminho de streaming
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_EVENTS = ("message", "message.any", "message.ack")
+READ_ACK = 3  # READ (PLAYED = 4 também conta como lida)
+MAX_TIMESTAMP_SECONDS = 1e11  # Acima disso o valor está em milissegundos
+CLOCK_SKEW = 300  # Tolerância (s) para timestamps no futuro
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """Timestamp em segundos a partir de número, string numérica ou ISO 8601
+
+    Valores em milissegundos são convertidos e timestamps no futuro são
+    limitados a agora + CLOCK_SKEW (não fixam a janela da última hora).
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value) or value <= 0:
+            return None
+        timestamp = value / 1000 if value > MAX_TIMESTAMP_SECONDS else float(value)
+    elif isinstance(value, str):
+        try:
+            return parse_timestamp(float(value))
+        except ValueError:
+            pass
+        try:
+            timestamp = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    else:
+        return None
+    return min(timestamp, time.time() + CLOCK_SKEW)
+
+
+class QuantileSketch:
+    """Sketch de quantis com erro relativo limitado (estilo DDSketch)
+
+    Valores caem em buckets logarítmicos; o número de buckets depende só da
+    faixa de valores, não da quantidade observada.
+    """
+
+    __slots__ = ("gamma", "log_gamma", "bins", "zeros", "count", "total")
+
+    def __init__(self, relative_accuracy: float = 0.02):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+        self.total += max(value, 0)
+
+    def add_many(self, values: "np.ndarray"):
+        """Versão vetorizada de add para o backfill"""
+        if not len(values):
+            return
+        positive = values[values > 0]
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        self.total += float(positive.sum())
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+        }
+
+
+class RollingCounter:
+    """Contagem em janela deslizante de 60 minutos (um bucket por minuto)"""
+
+    __slots__ = ("minutes", "counts")
+
+    WINDOW = 60
+
+    def __init__(self):
+        self.minutes = array("q", [-1] * self.WINDOW)
+        self.counts = array("q", [0] * self.WINDOW)
+
+    def add(self, timestamp: float, count: int = 1):
+        minute = int(timestamp // 60)
+        i = minute % self.WINDOW
+        if self.minutes[i] > minute:
+            return  # Mais antigo que a janela
+        if self.minutes[i] != minute:
+            self.minutes[i] = minute
+            self.counts[i] = 0
+        self.counts[i] += count
+
+    def total(self, now: float) -> int:
+        oldest = int(now // 60) - self.WINDOW
+        return sum(c for m, c in zip(self.minutes, self.counts) if m > oldest)
+
+
+class ChatState:
+    """Estado compacto por chat"""
+
+    __slots__ = ("pending_since", "answered", "last_timestamp", "messages", "last_reply_latency")
+
+    def __init__(self):
+        self.pending_since = 0.0  # Primeira mensagem do cliente ainda sem resposta (0 = nenhuma)
+        self.answered = False  # Já houve primeira resposta do vendedor
+        self.last_timestamp = 0.0
+        self.messages = 0
+        self.last_reply_latency: Optional[float] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "messages": self.messages,
+            "awaitingReply": bool(self.pending_since),
+            "pendingSince": self.pending_since or None,
+            "lastReplyLatency": self.last_reply_latency,
+            "lastMessageAt": self.last_timestamp or None,
+        }
+
+
+class SessionStats:
+    """Estado agregado por sessão (vendedor)"""
+
+    def __init__(self):
+        self.chats: Dict[str, ChatState] = {}
+        self.first_response = QuantileSketch()
+        self.reply_latency = QuantileSketch()
+        self.last_hour = RollingCounter()
+        self.unanswered = 0
+        self.inbound = 0
+        self.outbound = 0
+        self.read_receipts = 0
+        self.first_timestamp = 0.0
+        self.last_timestamp = 0.0
+        self.backfilled_at: Optional[float] = None
+
+    def chat(self, chat_id: str) -> ChatState:
+        state = self.chats.get(chat_id)
+        if state is None:
+            state = self.chats[chat_id] = ChatState()
+        return state
+
+    def _track_time(self, timestamp: float):
+        if not self.first_timestamp or timestamp < self.first_timestamp:
+            self.first_timestamp = timestamp
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+
+    def observe(self, chat_id: str, timestamp: float, from_me: bool):
+        state = self.chat(chat_id)
+        state.messages += 1
+        state.last_timestamp = max(state.last_timestamp, timestamp)
+        self.last_hour.add(timestamp)
+        self._track_time(timestamp)
+
+        if not from_me:
+            self.inbound += 1
+            if not state.pending_since:
+                state.pending_since = timestamp
+                self.unanswered += 1
+            return
+
+        self.outbound += 1
+        if state.pending_since:
+            latency = max(timestamp - state.pending_since, 0)
+            self.reply_latency.add(latency)
+            if not state.answered:
+                self.first_response.add(latency)
+            state.last_reply_latency = latency
+            state.pending_since = 0.0
+            self.unanswered -= 1
+        state.answered = True
+
+    def snapshot(self, now: float) -> dict:
+        span_hours = (self.last_timestamp - self.first_timestamp) / 3600
+        total = self.inbound + self.outbound
+        return {
+            "chats": len(self.chats),
+            "unansweredChats": self.unanswered,
+            "messages": {
+                "total": total,
+                "inbound": self.inbound,
+                "outbound": self.outbound,
+                "lastHour": self.last_hour.total(now),
+                "perHour": total / span_hours if span_hours >= 1 else total,
+            },
+            "firstResponse": self.first_response.summary(),
+            "replyLatency": self.reply_latency.summary(),
+            "readReceipts": self.read_receipts,
+            "backfilledAt": self.backfilled_at,
+        }
+
+
+class SalesAnalytics:
+    """Agregador incremental alimentado pelos eventos message, message.any e message.ack"""
+
+    def __init__(self, dedupe_size: int = 10000):
+        self.sessions: Dict[str, SessionStats] = {}
+        self.coverage: Optional[dict] = None  # Origem do estado após um restart (ver mark_rebuilt)
+        self.dedupe_size = dedupe_size
+        self._seen: "OrderedDict[str, None]" = OrderedDict()  # message e message.any repetem a mesma mensagem
+
+    def session(self, name: str) -> SessionStats:
+        stats = self.sessions.get(name)
+        if stats is None:
+            stats = self.sessions[name] = SessionStats()
+        return stats
+
+    def _first_seen(self, key: str, seen: Optional[set] = None) -> bool:
+        if seen is not None:
+            if key in seen:
+                return False
+            seen.add(key)
+            return True
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.dedupe_size:
+            self._seen.popitem(last=False)
+        return True
+
+    @staticmethod
+    def _chat_id(message: dict) -> Optional[str]:
+        return message.get("to") if message.get("fromMe") else message.get("from")
+
+    def handle_event(self, data: dict, seen: Optional[set] = None, stats: Optional[SessionStats] = None):
+        """Processa um evento de webhook (ignora os demais tipos)
+
+        `seen` substitui a deduplicação global e `stats` a sessão de destino
+        (usados na reaplicação do backfill, antes de instalar a sessão nova).
+        """
+        event_type = data.get("event")
+        payload = data.get("payload")
+        if event_type not in ANALYTICS_EVENTS or not isinstance(payload, dict):
+            return
+
+        message_id = payload.get("id")
+        chat_id = self._chat_id(payload)
+        if not message_id or not chat_id:
+            return
+        if stats is None:
+            stats = self.session(data.get("session", "default"))
+
+        if event_type == "message.ack":
+            if payload.get("fromMe") and (payload.get("ack") or 0) >= READ_ACK and self._first_seen(f"{message_id}:read", seen):
+                stats.read_receipts += 1
+            return
+
+        if self._first_seen(message_id, seen):
+            timestamp = parse_timestamp(payload.get("timestamp"))
+            if timestamp is None:
+                logger.warning(f"⚠️ Analytics: timestamp inválido em {message_id}, usando horário atual")
+                timestamp = time.time()
+            stats.observe(chat_id, timestamp, bool(payload.get("fromMe")))
+
+    def backfill(self, session: str, histories: Dict[str, List[dict]], catch_up: Iterable[dict] = ()):
+        """Reconstrói a sessão a partir do histórico de mensagens do Waha
+
+        Substitui o estado atual da sessão. `catch_up` são os eventos recebidos
+        enquanto o histórico era baixado; os que já estão no histórico são
+        ignorados. No servidor as três etapas rodam separadas (ver main.py).
+        """
+        stats, history_ids = self.build_backfill(histories)
+        self.catch_up(session, stats, history_ids, catch_up)
+        self.install_backfill(session, stats, history_ids)
+        return stats
+
+    def build_backfill(self, histories: Dict[str, List[dict]]) -> Tuple[SessionStats, set]:
+        """Etapa pesada do backfill; não toca no estado compartilhado (pode rodar em thread)
+
+        Com numpy cada chat é processado em lote; sem numpy as mensagens passam
+        pelo mesmo caminho do streaming.
+        """
+        stats = SessionStats()
+        history_ids = set()
+        for chat_id, messages in histories.items():
+            entries = []
+            for message in messages if isinstance(messages, list) else []:
+                if not isinstance(message, dict) or not message.get("id"):
+                    continue
+                timestamp = parse_timestamp(message.get("timestamp"))
+                if timestamp is None:
+                    continue
+                history_ids.add(message["id"])
+                entries.append((timestamp, bool(message.get("fromMe"))))
+            entries.sort(key=lambda entry: entry[0])
+
+            if NUMPY_AVAILABLE:
+                self._backfill_chat(stats, chat_id, entries)
+            else:
+                for timestamp, from_me in entries:
+                    stats.observe(chat_id, timestamp, from_me)
+        return stats, history_ids
+
+    def catch_up(self, session: str, stats: SessionStats, history_ids: set, events: Iterable[dict]):
+        """Aplica na sessão ainda não instalada os eventos que não estão no histórico"""
+        for data in events:
+            if data.get("session", "default") == session:
+                self.handle_event(data, seen=history_ids, stats=stats)
+
+    def install_backfill(self, session: str, stats: SessionStats, history_ids: set):
+        """Troca o estado da sessão pelo reconstruído"""
+        for message_id in history_ids:
+            self._first_seen(message_id)
+        stats.backfilled_at = time.time()
+        self.sessions[session] = stats
+        logger.info(f"📈 Backfill {session}: {len(stats.chats)} chats, {stats.inbound + stats.outbound} mensagens")
+
+    @staticmethod
+    def _backfill_chat(stats: SessionStats, chat_id: str, entries: List[Tuple[float, bool]]):
+        """Equivalente vetorizado de SessionStats.observe para um chat inteiro"""
+        if not entries:
+            return
+        timestamps = np.fromiter((e[0] for e in entries), dtype=np.float64, count=len(entries))
+        from_me = np.fromiter((e[1] for e in entries), dtype=bool, count=len(entries))
+
+        # Blocos consecutivos do mesmo remetente; cada bloco do cliente seguido
+        # de um bloco do vendedor é uma resposta (latência = início a início)
+        starts = np.flatnonzero(np.concatenate(([True], from_me[1:] != from_me[:-1])))
+        inbound_runs = np.flatnonzero(~from_me[starts])
+        replied = inbound_runs[inbound_runs + 1 < len(starts)]
+        latencies = np.maximum(timestamps[starts[replied + 1]] - timestamps[starts[replied]], 0)
+
+        state = stats.chat(chat_id)
+        state.messages += len(entries)
+        state.last_timestamp = max(state.last_timestamp, float(timestamps[-1]))
+        state.answered = bool(from_me.any())
+        if len(latencies):
+            stats.reply_latency.add_many(latencies)
+            if not from_me[0]:  # Primeira resposta só conta em chats iniciados pelo cliente
+                stats.first_response.add(float(latencies[0]))
+            state.last_reply_latency = float(latencies[-1])
+        if not from_me[-1]:
+            state.pending_since = float(timestamps[starts[-1]])
+            stats.unanswered += 1
+
+        outbound = int(from_me.sum())
+        stats.outbound += outbound
+        stats.inbound += len(entries) - outbound
+        stats._track_time(float(timestamps[0]))
+        stats._track_time(float(timestamps[-1]))
+
+        recent = timestamps[timestamps >= timestamps[-1] - RollingCounter.WINDOW * 60]
+        minutes, counts = np.unique((recent // 60).astype(np.int64), return_counts=True)
+        for minute, count in zip(minutes.tolist(), counts.tolist()):
+            stats.last_hour.add(minute * 60, count)
+
+    def mark_rebuilt(self, first_offset: int, since: Optional[float]):
+        """Registra que o estado veio só do journal (restart); backfills anteriores se perderam"""
+        self.coverage = {"rebuiltAt": time.time(), "journalFirstOffset": first_offset, "journalSince": since}
+
+    def snapshot(self, session: Optional[str] = None, now: Optional[float] = None) -> dict:
+        """Snapshot das métricas; custo independe do tamanho do histórico
+
+        `coverage` indica que as métricas cobrem só o journal desde `journalSince`;
+        sessões sem `backfilledAt` precisam de novo backfill para o histórico completo.
+        """
+        now = now or time.time()
+        if session is not None:
+            stats = self.sessions.get(session)
+            return {"session": session, **(stats or SessionStats()).snapshot(now), "coverage": self.coverage}
+        return {name: {**stats.snapshot(now), "coverage": self.coverage} for name, stats in self.sessions.items()}
+
+    def chat_snapshot(self, session: str, chat_id: str) -> Optional[dict]:
+        stats = self.sessions.get(session)
+        state = stats.chats.get(chat_id) if stats else None
+        return state.snapshot() if state else None
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark do journal de eventos
+Mede throughput de append, latência de replay na reconexão e tempo de recuperação
+"""
+
+import json
+import shutil
+import tempfile
+import time
+
+from journal import Journal
+
+# Configuração
+EVENTS = 200_000
+SEGMENT_BYTES = 16 * 1024 * 1024
+REPLAY_GAPS = [10, 100, 1_000, 10_000]  # eventos perdidos durante a desconexão
+
+
+def make_event(i: int) -> bytes:
+    """Evento message.any típico do Waha (~500 bytes)"""
+    return json.dumps({
+        "id": f"evt_{i}",
+        "event": "message.any",
+        "session": "default",
+        "payload": {
+            "id": f"false_5511999999999@c.us_{i:020d}",
+            "timestamp": 1700000000 + i,
+            "from": "5511999999999@c.us",
+            "fromMe": i % 2 == 0,
+            "body": "Olá! Gostaria de saber mais sobre o produto. " * 4,
+            "hasMedia": False,
+            "ack": 1,
+        },
+        "offset": i + 1,
+    }).encode("utf-8")
+
+
+def main():
+    print("📊 Benchmark do journal de eventos")
+    print("=" * 40)
+
+    directory = tempfile.mkdtemp(prefix="bench_journal_")
+    events = [make_event(i) for i in range(EVENTS)]
+    payload_bytes = sum(len(e) for e in events)
+
+    try:
+        journal = Journal(directory, SEGMENT_BYTES, retention_bytes=10 ** 12, retention_seconds=86400)
+
+        start = time.perf_counter()
+        for event in events:
+            journal.append(event)
+        elapsed = time.perf_counter() - start
+
+        print(f"Eventos: {EVENTS} | Payload: {payload_bytes / 1024 / 1024:.1f} MB | Segmentos: {len(journal.segments)}")
+        print()
+        print("✍️ Append")
+        print(f"   Throughput:      {EVENTS / elapsed:12,.0f} eventos/s")
+        print(f"                    {payload_bytes / elapsed / 1024 / 1024:12,.1f} MB/s")
+        print(f"   Latência média:  {elapsed / EVENTS * 1e6:12.2f} µs")
+        print()
+
+        print("🔁 Replay (reconexão)")
+        for gap in REPLAY_GAPS:
+            offset = journal.last_offset - gap
+            start = time.perf_counter()
+            replayed = journal.read_from(offset + 1, limit=gap)
+            elapsed = time.perf_counter() - start
+            assert len(replayed) == gap and replayed[0][0] == offset + 1
+            print(f"   {gap:>6} eventos:  {elapsed * 1000:10.2f} ms")
+        journal.close()
+        print()
+
+        start = time.perf_counter()
+        reopened = Journal(directory, SEGMENT_BYTES, retention_bytes=10 ** 12, retention_seconds=86400)
+        elapsed = time.perf_counter() - start
+        assert reopened.last_offset == EVENTS
+        reopened.close()
+        print("♻️ Recuperação (restart do backend)")
+        print(f"   Abrir e indexar: {elapsed * 1000:10.2f} ms")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
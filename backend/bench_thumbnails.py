@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark de thumbnails
+Compara bytes e tempo de decodificação ao abrir um chat com mídia completa vs thumbnails
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+# Cache isolado para o benchmark (precisa vir antes de importar config)
+os.environ["THUMBNAIL_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_thumbs_")
+
+import thumbnails
+from PIL import Image
+
+# Configuração - um chat aberto carrega 40 mensagens (selectChat)
+CHAT_MESSAGES = 40
+PHOTO_SIZE = (1200, 1600)  # Resolução em que o WhatsApp entrega fotos
+
+
+def make_photo(seed: int) -> bytes:
+    """Gera uma foto sintética (fractal + ruído leve, comprime como uma foto real)"""
+    extent = (-2.0 + seed * 0.01, -1.5, 1.0, 1.5)
+    fractal = Image.effect_mandelbrot(PHOTO_SIZE, extent, 64 + seed)
+    noise = Image.effect_noise(PHOTO_SIZE, 24)
+    gradient = Image.linear_gradient("L").resize(PHOTO_SIZE)
+    photo = Image.merge("RGB", (fractal, Image.blend(gradient, noise, 0.3), noise))
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def decode_time(blobs) -> float:
+    """Tempo para decodificar todas as imagens (proxy do custo de render no navegador)"""
+    start = time.perf_counter()
+    for blob in blobs:
+        with Image.open(io.BytesIO(blob)) as image:
+            image.load()
+    return time.perf_counter() - start
+
+
+async def generate_all(photos) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        thumbnails.get_thumbnail(f"files/default/msg_{i}.jpeg", lambda p=photo: _fetch(p))
+        for i, photo in enumerate(photos)
+    ])
+    return time.perf_counter() - start
+
+
+async def _fetch(photo: bytes):
+    return photo, "image/jpeg"
+
+
+def main():
+    print("📊 Benchmark de thumbnails")
+    print("=" * 40)
+    print(f"Mensagens com mídia: {CHAT_MESSAGES} | Foto: {PHOTO_SIZE[0]}x{PHOTO_SIZE[1]}")
+    print()
+
+    if not thumbnails.PILLOW_AVAILABLE:
+        print("❌ Pillow não instalado. Execute: pip install -r requirements.txt")
+        sys.exit(1)
+
+    photos = [make_photo(i) for i in range(CHAT_MESSAGES)]
+
+    cold = asyncio.run(generate_all(photos))
+    warm = asyncio.run(generate_all(photos))
+    thumbnails.shutdown()
+
+    paths = [f"files/default/msg_{i}.jpeg" for i in range(CHAT_MESSAGES)]
+    thumbs = [thumbnails._thumb_path(thumbnails._index[p][0]).read_bytes() for p in paths]
+    placeholders = [thumbnails.get_placeholder(p) for p in paths]
+
+    full_bytes = sum(len(p) for p in photos)
+    thumb_bytes = sum(len(t) for t in thumbs)
+    placeholder_bytes = sum(len(p) for p in placeholders)
+
+    print("📦 Bytes ao abrir o chat")
+    print(f"   Mídia completa:  {full_bytes / 1024 / 1024:8.2f} MB")
+    print(f"   Thumbnails:      {thumb_bytes / 1024 / 1024:8.2f} MB")
+    print(f"   Placeholders:    {placeholder_bytes / 1024:8.2f} KB (no payload JSON)")
+    print(f"   Redução:         {full_bytes / max(thumb_bytes + placeholder_bytes, 1):8.1f}x")
+    print()
+    print("⏱️ Tempo de decodificação (render)")
+    print(f"   Mídia completa:  {decode_time(photos) * 1000:8.1f} ms")
+    print(f"   Thumbnails:      {decode_time(thumbs) * 1000:8.1f} ms")
+    print()
+    print("⚙️ Geração no backend")
+    print(f"   Cache frio:      {cold * 1000:8.1f} ms ({thumbnails.THUMBNAIL_WORKERS} workers)")
+    print(f"   Cache quente:    {warm * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
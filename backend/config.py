@@ -38,6 +38,31 @@ WEBSOCKET_PING_TIMEOUT = int(os.getenv("WEBSOCKET_PING_TIMEOUT", "10"))
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "30"))
 API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
 
+# Thumbnail configuration
+THUMBNAIL_CACHE_DIR = Path(os.getenv("THUMBNAIL_CACHE_DIR", Path(__file__).parent / ".cache" / "thumbnails"))
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "320"))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "70"))
+THUMBNAIL_PLACEHOLDER_SIZE = int(os.getenv("THUMBNAIL_PLACEHOLDER_SIZE", "16"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+THUMBNAIL_INDEX_MAX_ENTRIES = int(os.getenv("THUMBNAIL_INDEX_MAX_ENTRIES", "50000"))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.getenv("THUMBNAIL_MAX_SOURCE_BYTES", str(32 * 1024 * 1024)))
+
+# Event journal configuration (replay de webhooks na reconexão do WebSocket)
+JOURNAL_DIR = Path(os.getenv("JOURNAL_DIR", Path(__file__).parent / ".cache" / "journal"))
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+JOURNAL_RETENTION_BYTES = int(os.getenv("JOURNAL_RETENTION_BYTES", str(256 * 1024 * 1024)))
+JOURNAL_RETENTION_HOURS = int(os.getenv("JOURNAL_RETENTION_HOURS", "24"))
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "false").lower() == "true"
+JOURNAL_REPLAY_BATCH = int(os.getenv("JOURNAL_REPLAY_BATCH", "500"))
+
+# Analytics configuration (backfill a partir do histórico do Waha)
+ANALYTICS_BACKFILL_CHATS = int(os.getenv("ANALYTICS_BACKFILL_CHATS", "100"))
+ANALYTICS_BACKFILL_MESSAGES = int(os.getenv("ANALYTICS_BACKFILL_MESSAGES", "1000"))
+ANALYTICS_BACKFILL_MAX_CHATS = int(os.getenv("ANALYTICS_BACKFILL_MAX_CHATS", "500"))
+ANALYTICS_BACKFILL_MAX_MESSAGES = int(os.getenv("ANALYTICS_BACKFILL_MAX_MESSAGES", "5000"))
+
 # Development configuration
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 RELOAD = os.getenv("RELOAD", "true").lower() == "true"
@@ -0,0 +1,281 @@
+"""
+Journal de eventos - append-only, segmentado e mapeado em memória
+Guarda os webhooks com offsets crescentes para replay na reconexão do WebSocket
+"""
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Registro: offset, timestamp (ms), tamanho do payload, crc32 do payload
+HEADER = struct.Struct("<QQII")
+
+RETENTION_CHECK_MS = 60_000  # Intervalo mínimo entre verificações de retenção
+
+
+class Segment:
+    """Arquivo de segmento {base_offset}.log com índice de posições em memória"""
+
+    def __init__(self, path: Path, base_offset: int):
+        self.path = path
+        self.base_offset = base_offset
+        self.positions = array("Q")  # posição do registro base_offset + i
+        self.size = 0
+        self.first_timestamp = 0
+        self.last_timestamp = 0
+        self.mm: Optional[mmap.mmap] = None  # só o segmento ativo fica mapeado
+
+    @property
+    def next_offset(self) -> int:
+        return self.base_offset + len(self.positions)
+
+    def _track(self, position: int, timestamp: int, record_size: int):
+        self.positions.append(position)
+        if not self.first_timestamp:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.size = position + record_size
+
+    def open(self, capacity: int):
+        """Cria o arquivo pré-alocado e mapeia para escrita"""
+        with open(self.path, "wb") as f:
+            f.truncate(capacity)
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            self.mm = mmap.mmap(fd, capacity)
+        finally:
+            os.close(fd)
+
+    def append(self, offset: int, timestamp: int, payload: bytes) -> bool:
+        record_size = HEADER.size + len(payload)
+        if self.size + record_size > len(self.mm):
+            return False
+        position = self.size
+        HEADER.pack_into(self.mm, position, offset, timestamp, len(payload), zlib.crc32(payload))
+        self.mm[position + HEADER.size:position + record_size] = payload
+        self._track(position, timestamp, record_size)
+        return True
+
+    def flush(self):
+        if self.mm is not None:
+            self.mm.flush()
+
+    def seal(self):
+        """Fecha o mapeamento e corta o espaço pré-alocado não usado"""
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+        os.truncate(self.path, self.size)
+
+    def recover(self) -> bool:
+        """Reconstrói o índice de um segmento existente, descartando cauda corrompida"""
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        position = 0
+        while position + HEADER.size <= len(data):
+            offset, timestamp, length, crc = HEADER.unpack_from(data, position)
+            end = position + HEADER.size + length
+            if offset != self.next_offset or end > len(data):
+                break
+            if zlib.crc32(data[position + HEADER.size:end]) != crc:
+                break
+            self._track(position, timestamp, HEADER.size + length)
+            position = end
+
+        if self.size != len(data):
+            logger.warning(f"⚠️ Journal: descartando {len(data) - self.size} bytes inválidos em {self.path.name}")
+            os.truncate(self.path, self.size)
+        return len(self.positions) > 0
+
+    def read(self, offset: int, limit: int) -> List[Tuple[int, bytes]]:
+        start = offset - self.base_offset
+        positions = self.positions[start:start + limit]
+        if not positions:
+            return []
+
+        if self.mm is not None:
+            return self._read_records(self.mm, offset, positions)
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self._read_records(mm, offset, positions)
+
+    @staticmethod
+    def _read_records(mm, offset: int, positions) -> List[Tuple[int, bytes]]:
+        events = []
+        for i, position in enumerate(positions):
+            length = HEADER.unpack_from(mm, position)[2]
+            start = position + HEADER.size
+            events.append((offset + i, mm[start:start + length]))
+        return events
+
+
+class Journal:
+    """Log append-only de eventos com retenção por tamanho e idade
+
+    Offsets começam em 1 e nunca se repetem. Segmentos antigos são removidos
+    inteiros; um cliente cujo offset já saiu da retenção precisa de resync.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int, retention_bytes: int,
+                 retention_seconds: int, fsync: bool = False):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.fsync = fsync
+        self.segments: List[Segment] = []
+        self.base_offsets: List[int] = []
+        self._retention_checked_at = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self.enforce_retention()
+
+    def _segment_path(self, base_offset: int) -> Path:
+        return self.directory / f"{base_offset:020d}.log"
+
+    def _load(self):
+        paths = sorted(self.directory.glob("*.log"))
+        for path in paths:
+            segment = Segment(path, int(path.stem))
+            if self.segments and segment.base_offset != self.next_offset:
+                logger.warning(f"⚠️ Journal: lacuna antes de {path.name}, descartando segmentos anteriores")
+                self._delete_segments(len(self.segments))
+            # Último segmento vazio é mantido: o nome preserva o próximo offset
+            if segment.recover() or path == paths[-1]:
+                self._add_segment(segment)
+            else:
+                path.unlink()
+        logger.info(f"📒 Journal carregado: offsets {self.first_offset}..{self.next_offset - 1}")
+
+    def _add_segment(self, segment: Segment):
+        self.segments.append(segment)
+        self.base_offsets.append(segment.base_offset)
+
+    def _delete_segments(self, count: int):
+        for segment in self.segments[:count]:
+            segment.seal()
+            segment.path.unlink(missing_ok=True)
+        del self.segments[:count]
+        del self.base_offsets[:count]
+
+    def _roll(self, record_size: int = 0) -> Segment:
+        if self.segments:
+            last = self.segments[-1]
+            last.seal()
+            if not last.positions:
+                # Vazio: tem o mesmo base_offset do novo segmento
+                last.path.unlink(missing_ok=True)
+                self.segments.pop()
+                self.base_offsets.pop()
+        segment = Segment(self._segment_path(self.next_offset), self.next_offset)
+        segment.open(max(self.segment_bytes, record_size))
+        self._add_segment(segment)
+        return segment
+
+    @property
+    def first_offset(self) -> int:
+        return self.base_offsets[0] if self.segments else self.next_offset
+
+    @property
+    def next_offset(self) -> int:
+        return self.segments[-1].next_offset if self.segments else 1
+
+    @property
+    def last_offset(self) -> int:
+        return self.next_offset - 1
+
+    @property
+    def first_timestamp(self) -> Optional[float]:
+        """Horário (s) do evento mais antigo ainda retido"""
+        for segment in self.segments:
+            if segment.positions:
+                return segment.first_timestamp / 1000
+        return None
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    def append(self, payload: bytes) -> int:
+        """Adiciona um evento e retorna seu offset"""
+        offset = self.next_offset
+        timestamp = int(time.time() * 1000)
+
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.mm is None or not segment.append(offset, timestamp, payload):
+            segment = self._roll(HEADER.size + len(payload))
+            segment.append(offset, timestamp, payload)
+            self.enforce_retention()
+        else:
+            self._maybe_enforce_retention(timestamp)
+
+        if self.fsync:
+            segment.flush()
+        return offset
+
+    def read_from(self, offset: int, limit: int = 1000) -> List[Tuple[int, bytes]]:
+        """Eventos a partir de `offset` (inclusive), em ordem, até `limit`
+
+        Não aplica retenção (só o append remove segmentos); se `offset` já
+        expirou, o primeiro evento retornado é posterior a ele.
+        """
+        offset = max(offset, self.first_offset)
+        events: List[Tuple[int, bytes]] = []
+        index = bisect.bisect_right(self.base_offsets, offset) - 1
+
+        for segment in self.segments[max(index, 0):]:
+            batch = segment.read(offset, limit - len(events))
+            events.extend(batch)
+            offset += len(batch)
+            if len(events) >= limit:
+                break
+        return events
+
+    def _maybe_enforce_retention(self, now_ms: int):
+        if now_ms - self._retention_checked_at >= RETENTION_CHECK_MS:
+            self.enforce_retention()
+
+    def enforce_retention(self):
+        """Remove segmentos selados que excedem o tamanho total ou a idade máxima
+
+        O segmento ativo é selado quando seu registro mais antigo passa da idade
+        máxima, para que expire mesmo com pouco tráfego.
+        """
+        now_ms = int(time.time() * 1000)
+        self._retention_checked_at = now_ms
+        cutoff = now_ms - self.retention_seconds * 1000
+
+        active = self.segments[-1] if self.segments else None
+        if active is not None and active.positions and active.first_timestamp < cutoff:
+            self._roll()
+
+        total = self.size
+        expired = 0
+
+        # O segmento ativo (último) nunca é removido
+        for segment in self.segments[:-1]:
+            if total <= self.retention_bytes and segment.last_timestamp >= cutoff:
+                break
+            total -= segment.size
+            expired += 1
+
+        if expired:
+            self._delete_segments(expired)
+            logger.info(f"🧹 Journal: {expired} segmento(s) removido(s), primeiro offset agora {self.first_offset}")
+
+    def close(self):
+        if self.segments:
+            self.segments[-1].seal()
@@ -4,19 +4,24 @@ WhatsApp Web Backend - Minimalista
 Serve frontend e conecta com Waha API
 """
 
+import asyncio
 import json
 import logging
+import re
 from pathlib import Path
-from typing import Dict, Set
+from typing import Dict, Optional, Set
 
 import uvicorn
 import httpx
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import JSONResponse, HTMLResponse, Response
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.responses import JSONResponse, HTMLResponse, Response, FileResponse
 from fastapi.staticfiles import StaticFiles
 
 # Import configuration
 from config import *
+import thumbnails
+from journal import Journal
+from analytics import SalesAnalytics
 
 # Setup
 app = FastAPI(title="WhatsApp Web API")
@@ -26,6 +31,21 @@ logger = logging.getLogger(__name__)
 # WebSocket connections
 connections: Dict[str, Set[WebSocket]] = {}
 
+# Journal de eventos para replay na reconexão
+journal = Journal(
+    JOURNAL_DIR,
+    segment_bytes=JOURNAL_SEGMENT_BYTES,
+    retention_bytes=JOURNAL_RETENTION_BYTES,
+    retention_seconds=JOURNAL_RETENTION_HOURS * 3600,
+    fsync=JOURNAL_FSYNC,
+)
+
+# Métricas de atendimento, alimentadas pelos webhooks
+analytics = SalesAnalytics()
+
+# Listagem de mensagens de um chat: {session}/chats/{chatId}/messages
+MESSAGES_PATH = re.compile(r"^[^/]+/chats/[^/]+/messages$")
+
 # Serve frontend
 app.mount("/static", StaticFiles(directory=FRONTEND_PATH), name="static")
 
@@ -40,6 +60,163 @@ async def ping():
     """Endpoint de teste"""
     return JSONResponse({"status": "ok", "message": "Backend is running"})
 
+def journal_events(offset: int):
+    """Eventos do journal (já decodificados) a partir de `offset`"""
+    while True:
+        events = journal.read_from(offset, limit=JOURNAL_REPLAY_BATCH)
+        if not events:
+            return
+        for _, payload in events:
+            yield json.loads(payload)
+        offset = events[-1][0] + 1
+
+@app.on_event("startup")
+async def startup():
+    """Reconstrói o analytics a partir dos eventos ainda no journal
+
+    Backfills feitos antes do restart não são persistidos: o snapshot passa a
+    indicar a cobertura do journal e o backfill precisa ser executado de novo.
+    """
+    for data in journal_events(journal.first_offset):
+        try:
+            analytics.handle_event(data)
+        except Exception as e:
+            logger.error(f"❌ Analytics error: {e}")
+    analytics.mark_rebuilt(journal.first_offset, journal.first_timestamp)
+    logger.info(f"📈 Analytics reconstruído até o offset {journal.last_offset}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Encerra o process pool de thumbnails e fecha o journal"""
+    thumbnails.shutdown()
+    journal.close()
+
+# Thumbnails de mídia - /thumbs/files/...
+@app.get(thumbnails.THUMBNAIL_ROUTE + "/{path:path}")
+async def media_thumbnail(path: str):
+    """Thumbnail reduzido de uma mídia do Waha (gerado sob demanda e cacheado)"""
+    if not path.startswith("files/"):
+        return JSONResponse({"error": "File not found"}, status_code=404)
+
+    async def fetch_original():
+        headers = {"X-Api-Key": WAHA_API_KEY} if WAHA_API_KEY else {}
+        async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
+            async with client.stream("GET", f"{WAHA_URL}/api/{path}", headers=headers) as response:
+                response.raise_for_status()
+                # Limite checado antes de bufferizar (Content-Length) e durante o download
+                length = response.headers.get("content-length")
+                if length and length.isdigit() and int(length) > THUMBNAIL_MAX_SOURCE_BYTES:
+                    raise thumbnails.SourceTooLarge(f"{length} bytes")
+                content = bytearray()
+                async for chunk in response.aiter_bytes():
+                    content += chunk
+                    if len(content) > THUMBNAIL_MAX_SOURCE_BYTES:
+                        raise thumbnails.SourceTooLarge(f"> {THUMBNAIL_MAX_SOURCE_BYTES} bytes")
+                return bytes(content), response.headers.get("content-type", "")
+
+    try:
+        thumb = await thumbnails.get_thumbnail(path, fetch_original)
+    except httpx.HTTPStatusError:
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    except httpx.RequestError as e:
+        logger.error(f"Thumbnail Request Error: {repr(e)}")
+        return JSONResponse({"error": str(e)}, status_code=502)
+    except Exception as e:
+        logger.error(f"Thumbnail Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    if thumb is None:
+        return JSONResponse({"error": "Thumbnail not available"}, status_code=404)
+
+    return FileResponse(
+        thumb,
+        media_type=thumbnails.THUMBNAIL_MEDIA_TYPES.get(THUMBNAIL_FORMAT, "image/webp"),
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+# Analytics
+@app.get("/analytics")
+async def analytics_overview():
+    """Métricas de todas as sessões (vendedores)"""
+    return JSONResponse(analytics.snapshot())
+
+@app.get("/analytics/{session}")
+async def analytics_session(session: str):
+    """Métricas de uma sessão"""
+    return JSONResponse(analytics.snapshot(session))
+
+@app.get("/analytics/{session}/chats/{chat_id}")
+async def analytics_chat(session: str, chat_id: str):
+    """Estado de um chat (aguardando resposta, última latência)"""
+    snapshot = analytics.chat_snapshot(session, chat_id)
+    if snapshot is None:
+        return JSONResponse({"error": "Chat not found"}, status_code=404)
+    return JSONResponse(snapshot)
+
+@app.post("/analytics/{session}/backfill")
+async def analytics_backfill(session: str,
+                             chats: int = Query(ANALYTICS_BACKFILL_CHATS, ge=1, le=ANALYTICS_BACKFILL_MAX_CHATS),
+                             messages: int = Query(ANALYTICS_BACKFILL_MESSAGES, ge=1, le=ANALYTICS_BACKFILL_MAX_MESSAGES)):
+    """Reconstrói as métricas da sessão a partir do histórico do Waha"""
+    headers = {"X-Api-Key": WAHA_API_KEY} if WAHA_API_KEY else {}
+    start_offset = journal.next_offset
+    semaphore = asyncio.Semaphore(8)
+
+    async with httpx.AsyncClient(timeout=API_TIMEOUT, headers=headers) as client:
+        async def fetch_messages(chat_id: str):
+            async with semaphore:
+                response = await client.get(
+                    f"{WAHA_URL}/api/{session}/chats/{chat_id}/messages",
+                    params={"limit": messages, "downloadMedia": "false"}
+                )
+                response.raise_for_status()
+                return chat_id, response.json()
+
+        try:
+            response = await client.get(f"{WAHA_URL}/api/{session}/chats", params={"limit": chats})
+            response.raise_for_status()
+            chats_data = response.json()
+            if not isinstance(chats_data, list):
+                return JSONResponse({"error": "Unexpected chats response"}, status_code=502)
+            chat_ids = []
+            for chat in chats_data:
+                chat_id = chat.get("id") if isinstance(chat, dict) else None
+                if isinstance(chat_id, dict):
+                    chat_id = chat_id.get("_serialized")
+                if chat_id:
+                    chat_ids.append(chat_id)
+            histories = dict(await asyncio.gather(*[fetch_messages(chat_id) for chat_id in chat_ids]))
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Backfill Error: {e}")
+            return JSONResponse({"error": str(e)}, status_code=e.response.status_code)
+        except httpx.RequestError as e:
+            logger.error(f"Backfill Request Error: {repr(e)}")
+            return JSONResponse({"error": str(e)}, status_code=502)
+        except Exception as e:
+            logger.error(f"Backfill Error: {e}")
+            return JSONResponse({"error": str(e)}, status_code=500)
+
+    try:
+        # Processamento pesado fora do event loop; a sessão nova só é instalada no fim
+        loop = asyncio.get_running_loop()
+        stats, history_ids = await loop.run_in_executor(None, analytics.build_backfill, histories)
+
+        # Eventos que chegaram desde o início são reaplicados em lotes (duplicatas são ignoradas).
+        # Sem await entre o último lote vazio e a instalação: nenhum evento ao vivo se perde.
+        offset = start_offset
+        while True:
+            events = journal.read_from(offset, limit=JOURNAL_REPLAY_BATCH)
+            if not events:
+                break
+            analytics.catch_up(session, stats, history_ids, (json.loads(payload) for _, payload in events))
+            offset = events[-1][0] + 1
+            await asyncio.sleep(0)
+        analytics.install_backfill(session, stats, history_ids)
+    except Exception as e:
+        logger.error(f"Backfill Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    return JSONResponse(analytics.snapshot(session))
+
 # Generic API Proxy - handles all /api/* requests
 @app.api_route("/api/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def api_proxy(request: Request, path: str):
@@ -80,6 +257,12 @@ async def api_proxy(request: Request, path: str):
                 else:
                     return JSONResponse({"error": "File not found"}, status_code=404)
             
+            # Mensagens do chat: anexar thumbnailUrl/placeholder às mídias
+            if request.method == "GET" and MESSAGES_PATH.match(path) and response.status_code == 200:
+                messages = response.json()
+                if isinstance(messages, list):
+                    return JSONResponse([thumbnails.annotate_media(m) for m in messages])
+            
             # Handle QR code responses (PNG data)
             if path.endswith("/qr") and response.status_code == 200:
                 return Response(
@@ -103,24 +286,59 @@ async def api_proxy(request: Request, path: str):
 
 # WebSocket
 @app.websocket("/ws/{phone}")
-async def websocket_endpoint(websocket: WebSocket, phone: str):
-    """WebSocket para eventos em tempo real"""
+async def websocket_endpoint(websocket: WebSocket, phone: str, offset: Optional[int] = None):
+    """WebSocket para eventos em tempo real
+
+    `offset` é o último evento recebido pelo cliente; os eventos perdidos
+    desde então são reenviados em ordem antes dos eventos ao vivo, seguidos
+    de `journal.replay_end`. Mensagens de controle levam `head` (não `offset`).
+    """
     await websocket.accept()
     
-    if phone not in connections:
-        connections[phone] = set()
-    connections[phone].add(websocket)
-    
-    logger.info(f"🔌 WebSocket conectado: {phone}")
-    
     try:
+        if offset is not None and not journal.first_offset - 1 <= offset <= journal.last_offset:
+            # Eventos já removidos pela retenção (ou journal reiniciado): cliente recarrega tudo
+            connections.setdefault(phone, set()).add(websocket)
+            await websocket.send_text(json.dumps({"event": "journal.reset", "head": journal.last_offset}))
+        elif offset is not None:
+            replayed = 0
+            gap = False
+            while True:
+                events = journal.read_from(offset + 1, limit=JOURNAL_REPLAY_BATCH)
+                if not events:
+                    break
+                if events[0][0] != offset + 1:
+                    # Retenção removeu eventos durante o replay: não entregar com lacuna
+                    gap = True
+                    break
+                for offset, payload in events:
+                    await websocket.send_text(payload.decode("utf-8"))
+                replayed += len(events)
+            # Sem await entre a última leitura e o registro: nenhum evento fica no meio.
+            # Eventos ao vivo podem chegar antes do replay_end; o cliente trata os dois casos.
+            connections.setdefault(phone, set()).add(websocket)
+            if gap:
+                await websocket.send_text(json.dumps({"event": "journal.reset", "head": journal.last_offset}))
+                logger.warning(f"⚠️ Replay interrompido para {phone}: eventos após {offset} expiraram")
+            else:
+                await websocket.send_text(json.dumps({"event": "journal.replay_end", "replayed": replayed, "head": offset}))
+                logger.info(f"🔁 Replay de {replayed} evento(s) para {phone}")
+        else:
+            connections.setdefault(phone, set()).add(websocket)
+            await websocket.send_text(json.dumps({"event": "journal.sync", "head": journal.last_offset}))
+        
+        logger.info(f"🔌 WebSocket conectado: {phone}")
+        
         while True:
             await websocket.receive_text()  # Keepalive
     except WebSocketDisconnect:
         logger.info(f"🔌 WebSocket desconectado: {phone}")
-        connections[phone].discard(websocket)
-        if not connections[phone]:
-            del connections[phone]
+    finally:
+        # Também em erros de envio durante o replay: não deixar socket morto registrado
+        if phone in connections:
+            connections[phone].discard(websocket)
+            if not connections[phone]:
+                del connections[phone]
 
 # Generic webhook handler
 @app.post("/webhook")
@@ -130,14 +348,28 @@ async def webhook_handler(request: Request):
         data = await request.json()
         event_type = data.get("event", "unknown")
         
+        if event_type in ("message", "message.any"):
+            thumbnails.annotate_media(data.get("payload"))
+        
+        # Persistir no journal antes do broadcast (offset vai junto no evento)
+        data["offset"] = journal.next_offset
+        message = json.dumps(data)
+        journal.append(message.encode("utf-8"))
+        
         # Broadcast to all WebSocket connections
-        for phone_connections in connections.values():
-            for websocket in phone_connections:
+        for phone_connections in list(connections.values()):
+            for websocket in list(phone_connections):
                 try:
-                    await websocket.send_text(json.dumps(data))
+                    await websocket.send_text(message)
                 except:
                     pass  # Connection might be closed
         
+        # Analytics depois do journal/broadcast: erro aqui não bloqueia o evento
+        try:
+            analytics.handle_event(data)
+        except Exception as e:
+            logger.error(f"❌ Analytics error ({event_type}): {e}")
+        
         logger.info(f"📨 Webhook {event_type} processado")
         return JSONResponse({"status": "ok"})
         
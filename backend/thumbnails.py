@@ -0,0 +1,344 @@
+"""
+Thumbnails e placeholders para mídia do chat
+Gera versões reduzidas (WebP/JPEG) fora do event loop e guarda em disco por hash
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from config import (
+    THUMBNAIL_CACHE_DIR,
+    THUMBNAIL_CACHE_MAX_BYTES,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_INDEX_MAX_ENTRIES,
+    THUMBNAIL_MAX_SIZE,
+    THUMBNAIL_PLACEHOLDER_SIZE,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_WORKERS,
+)
+
+try:
+    from PIL import Image, ImageOps
+    PILLOW_AVAILABLE = True
+    # Falhas do próprio conteúdo (UnidentifiedImageError é um OSError): cacheadas como negativas
+    DECODE_ERRORS: Tuple[type, ...] = (OSError, Image.DecompressionBombError)
+except ImportError:
+    # Pillow não instalado, thumbnails desabilitados
+    PILLOW_AVAILABLE = False
+    DECODE_ERRORS = (OSError,)
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_ROUTE = "/thumbs"
+THUMBNAIL_MEDIA_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+# Formatos que o Pillow decodifica (svg, heic etc. ficam com a mídia original)
+SUPPORTED_IMAGE_TYPES = {"image/jpeg", "image/jpg", "image/png", "image/webp", "image/gif"}
+FFMPEG = shutil.which("ffmpeg")
+
+INDEX_PATH = THUMBNAIL_CACHE_DIR / "index.jsonl"
+
+_executor: Optional[ProcessPoolExecutor] = None
+# LRUs em memória. Hash "" = original grande demais (negativo sem conteúdo)
+_index: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()  # arquivo no Waha -> (hash, placeholder; None = falhou)
+_digests: "OrderedDict[str, Tuple[Optional[str], int]]" = OrderedDict()  # hash -> (placeholder, bytes do thumbnail)
+_cache_bytes = 0
+_index_lines = 0
+_pending: dict = {}
+
+
+class SourceTooLarge(Exception):
+    """Original acima de THUMBNAIL_MAX_SOURCE_BYTES (não é baixado nem processado)"""
+
+
+# Worker (roda no process pool)
+def _extract_video_frame(content: bytes) -> Optional[bytes]:
+    """Extrai o primeiro frame de um vídeo como PNG usando ffmpeg"""
+    if not FFMPEG:
+        return None
+
+    with tempfile.NamedTemporaryFile(suffix=".video") as tmp:
+        tmp.write(content)
+        tmp.flush()
+        try:
+            result = subprocess.run(
+                [FFMPEG, "-loglevel", "error", "-i", tmp.name,
+                 "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+                capture_output=True,
+                timeout=30,
+            )
+        except subprocess.TimeoutExpired:
+            return None
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def render_previews(content: bytes, mimetype: str) -> Optional[Tuple[bytes, str]]:
+    """Gera (thumbnail, placeholder data URI) a partir do conteúdo original"""
+    if mimetype.startswith("video/"):
+        content = _extract_video_frame(content)
+        if content is None:
+            return None
+
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+        thumb = image.copy()
+        thumb.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        thumb_buffer = io.BytesIO()
+        thumb.save(thumb_buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+
+        # Placeholder minúsculo, embutido no payload e ampliado com blur no frontend
+        tiny = image.copy()
+        tiny.thumbnail((THUMBNAIL_PLACEHOLDER_SIZE, THUMBNAIL_PLACEHOLDER_SIZE))
+        tiny_buffer = io.BytesIO()
+        tiny.save(tiny_buffer, "JPEG", quality=30)
+
+    placeholder = "data:image/jpeg;base64," + base64.b64encode(tiny_buffer.getvalue()).decode("ascii")
+    return thumb_buffer.getvalue(), placeholder
+
+
+# Cache em disco: thumbnails por hash + índice (arquivo -> hash, placeholder) em memória
+def _thumb_path(digest: str) -> Path:
+    return THUMBNAIL_CACHE_DIR / f"{digest}.{THUMBNAIL_FORMAT.lower()}"
+
+
+def _remember(path: str, digest: str, placeholder: Optional[str], size: int):
+    global _cache_bytes
+    _index[path] = (digest, placeholder)
+    _index.move_to_end(path)
+    if not digest:
+        return
+    if digest in _digests:
+        _digests.move_to_end(digest)
+    else:
+        _digests[digest] = (placeholder, size)
+        _cache_bytes += size
+
+
+def _lookup(path: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Entrada do índice (marcando uso no LRU); None se desconhecida ou já removida"""
+    entry = _index.get(path)
+    if entry is None:
+        return None
+    digest = entry[0]
+    if digest and digest not in _digests:
+        del _index[path]  # Thumbnail removido pelo limite de tamanho
+        return None
+    _index.move_to_end(path)
+    if digest:
+        _digests.move_to_end(digest)
+    return entry
+
+
+def _prune():
+    """Aplica os limites: entradas do índice e bytes de thumbnails em disco (LRU)"""
+    global _cache_bytes
+    while len(_index) > THUMBNAIL_INDEX_MAX_ENTRIES:
+        _index.popitem(last=False)
+    while _digests and (_cache_bytes > THUMBNAIL_CACHE_MAX_BYTES or len(_digests) > THUMBNAIL_INDEX_MAX_ENTRIES):
+        digest, (placeholder, size) = _digests.popitem(last=False)
+        _cache_bytes -= size
+        if placeholder is not None:
+            _thumb_path(digest).unlink(missing_ok=True)
+
+
+def _compact():
+    """Reescreve index.jsonl só com as entradas vivas, na ordem do LRU"""
+    global _index_lines
+    tmp = INDEX_PATH.with_suffix(".tmp")
+    lines = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for path, (digest, placeholder) in _index.items():
+            if digest and digest not in _digests:
+                continue
+            size = _digests[digest][1] if digest else 0
+            f.write(json.dumps({"path": path, "digest": digest, "placeholder": placeholder, "size": size}) + "\n")
+            lines += 1
+    os.replace(tmp, INDEX_PATH)
+    _index_lines = lines
+
+
+def _maybe_compact():
+    if _index_lines > 2 * len(_index) + 1000:
+        _compact()
+
+
+def _load_index():
+    global _index_lines
+    if not INDEX_PATH.exists():
+        return
+    with open(INDEX_PATH, encoding="utf-8") as f:
+        for line in f:
+            _index_lines += 1
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Linha incompleta (queda durante a escrita)
+            digest, placeholder = entry["digest"], entry.get("placeholder")
+            size = entry.get("size", 0)
+            if placeholder is not None:
+                thumb = _thumb_path(digest)
+                if not thumb.exists():
+                    continue
+                size = size or thumb.stat().st_size
+            _remember(entry["path"], digest, placeholder, size)
+    _prune()
+    _maybe_compact()
+
+
+def _record(path: str, digest: str, placeholder: Optional[str], size: int = 0):
+    """Registra o resultado (placeholder None = mídia que não gera thumbnail)"""
+    global _index_lines
+    _remember(path, digest, placeholder, size)
+    THUMBNAIL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(INDEX_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"path": path, "digest": digest, "placeholder": placeholder, "size": size}) + "\n")
+    _index_lines += 1
+    _prune()
+    _maybe_compact()
+
+
+def is_supported(mimetype: Optional[str]) -> bool:
+    if not PILLOW_AVAILABLE or not mimetype:
+        return False
+    if mimetype.startswith("video/"):
+        return FFMPEG is not None
+    return mimetype in SUPPORTED_IMAGE_TYPES
+
+
+def get_placeholder(path: str) -> Optional[str]:
+    """Placeholder já gerado para o arquivo (não dispara geração)"""
+    entry = _lookup(path)
+    return entry[1] if entry else None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    """Descarta um pool quebrado (worker morto); o próximo uso cria outro"""
+    global _executor
+    if _executor is broken:
+        _executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def _render(content: bytes, mimetype: str) -> Optional[Tuple[bytes, str]]:
+    """Executa render_previews no pool, recriando-o uma vez se um worker morreu"""
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            return await loop.run_in_executor(executor, render_previews, content, mimetype)
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            if attempt:
+                raise
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _generate(path: str, fetch: Callable[[], Awaitable[Tuple[bytes, str]]]) -> Optional[Path]:
+    try:
+        content, mimetype = await fetch()
+    except SourceTooLarge as e:
+        logger.warning(f"⚠️ Thumbnail ignorado: {path} ({e})")
+        _record(path, "", None)
+        return None
+    digest = hashlib.sha256(content).hexdigest()
+
+    # Mesmo conteúdo em outro arquivo (ex.: mídia encaminhada) reaproveita o cache
+    if digest in _digests:
+        placeholder, size = _digests[digest]
+        _record(path, digest, placeholder, size)
+        return _thumb_path(digest) if placeholder is not None else None
+
+    # Pool quebrado de novo ou erro inesperado propagam (500) sem cachear:
+    # só falhas de decodificação do conteúdo viram entrada negativa
+    try:
+        previews = await _render(content, mimetype)
+    except DECODE_ERRORS as e:
+        previews = None
+        logger.warning(f"⚠️ Thumbnail falhou: {path} ({mimetype}): {e}")
+
+    if previews is None:
+        _record(path, digest, None)
+        return None
+
+    thumb, placeholder = previews
+    THUMBNAIL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _thumb_path(digest).write_bytes(thumb)
+    _record(path, digest, placeholder, len(thumb))
+    logger.info(f"🖼️ Thumbnail gerado: {path} ({len(content)} -> {len(thumb)} bytes)")
+    return _thumb_path(digest)
+
+
+async def get_thumbnail(path: str, fetch: Callable[[], Awaitable[Tuple[bytes, str]]]) -> Optional[Path]:
+    """Retorna o thumbnail do arquivo, gerando-o se necessário
+
+    `fetch` baixa o original do Waha e só é chamado em cache miss.
+    Requisições simultâneas para o mesmo arquivo compartilham a mesma geração.
+    Retorna None para mídia que já falhou antes (sem baixar de novo).
+    `fetch` deve levantar SourceTooLarge para originais acima do limite.
+    """
+    entry = _lookup(path)
+    if entry is not None:
+        digest, placeholder = entry
+        return _thumb_path(digest) if placeholder is not None else None
+
+    if path in _pending:
+        return await asyncio.shield(_pending[path])
+
+    future = asyncio.ensure_future(_generate(path, fetch))
+    _pending[path] = future
+    try:
+        return await future
+    finally:
+        _pending.pop(path, None)
+
+
+def annotate_media(message: dict) -> dict:
+    """Adiciona thumbnailUrl (e placeholder, se já existir) à mídia da mensagem"""
+    media = message.get("media") if isinstance(message, dict) else None
+    if not media or not media.get("url") or not is_supported(media.get("mimetype")):
+        return message
+
+    marker = "/api/files/"
+    url = media["url"]
+    if marker not in url:
+        return message
+
+    path = "files/" + url.split(marker, 1)[1]
+    entry = _lookup(path)
+    if entry is not None and entry[1] is None:
+        return message  # Falhou antes: frontend mostra a mídia original
+
+    media["thumbnailUrl"] = f"{THUMBNAIL_ROUTE}/{path}"
+    if entry is not None:
+        media["placeholder"] = entry[1]
+    return message
+
+
+_load_index()